@@ -1,8 +1,15 @@
 """
 Modified from OpenAI Baselines code to work with multi-agent envs
 """
+import pickle
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from multiprocessing import Process, Pipe
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Connection, wait
+from multiprocessing.shared_memory import SharedMemory
 from abc import ABC, abstractmethod
 
 
@@ -37,13 +44,105 @@ def tile_images(img_nhwc):
     N, h, w, c = img_nhwc.shape
     H = int(np.ceil(np.sqrt(N)))
     W = int(np.ceil(float(N)/H))
-    img_nhwc = np.array(list(img_nhwc) + [img_nhwc[0]*0 for _ in range(N, H*W)])
-    img_HWhwc = img_nhwc.reshape(H, W, h, w, c)
+    # blank cells stay zero, filled cells are written in a single slice assignment
+    img_padded = np.zeros((H*W, h, w, c), dtype=img_nhwc.dtype)
+    img_padded[:N] = img_nhwc
+    img_HWhwc = img_padded.reshape(H, W, h, w, c)
     img_HhWwc = img_HWhwc.transpose(0, 2, 1, 3, 4)
     img_Hh_Ww_c = img_HhWwc.reshape(H*h, W*w, c)
     return img_Hh_Ww_c
 
 
+# shareworker commands. Each goes out as a single raw byte, so the control messages skip pickling;
+# commands that carry data are followed by one pickled payload message
+(CMD_STEP, CMD_RESET, CMD_RESET_TASK, CMD_RENDER, CMD_CLOSE, CMD_GET_SPACES,
+ CMD_RENDER_VULNERABILITY, CMD_ATTACH_SHM) = range(8)
+_CMD_BYTES = [bytes((cmd,)) for cmd in range(8)]
+
+# shared blocks of closed vec envs that handed out views into them. They are unlinked but stay
+# mapped until the process exits: unmapping (SharedMemory.close, also run by its __del__) would
+# turn any view a caller still holds into a dangling pointer
+_MAPPED_SHMS = []
+
+
+def _get_context(start_method=None):
+    """
+    Multiprocessing context the workers are started from. By default fork on Linux: the Process
+    args (env_fns included) are then inherited by the child instead of being pickled once per
+    worker. Other platforms keep their default context (spawn on macOS, where fork is unsafe once
+    system frameworks are loaded) and the CloudpickleWrapper is serialized for each worker.
+    With start_method='forkserver' workers are forked from a clean server process that only
+    imports this module, so they do not inherit the trainer's torch/CUDA state.
+    """
+    if start_method is None and sys.platform.startswith('linux'):
+        start_method = 'fork'
+    ctx = multiprocessing.get_context(start_method)
+    if start_method == 'forkserver':
+        ctx.set_forkserver_preload([__name__])
+    return ctx
+
+
+def send_oob(remote, obj):
+    """
+    Send obj with pickle protocol 5. Contiguous ndarrays are not copied into the pickle stream but
+    written to the pipe as raw out-of-band frames right after it. Pair with recv_oob.
+    """
+    buffers = []
+    header = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    frames = [buf.raw() for buf in buffers]
+    remote.send((header, [frame.nbytes for frame in frames]))
+    for frame in frames:
+        remote.send_bytes(frame)
+
+
+def recv_oob(remote):
+    """
+    Receive an object sent with send_oob. Frames are read straight into fresh bytearrays so the
+    rebuilt ndarrays are writable and need no further copy.
+    """
+    header, sizes = remote.recv()
+    buffers = []
+    for size in sizes:
+        buf = bytearray(size)
+        remote.recv_bytes_into(buf)
+        buffers.append(buf)
+    return pickle.loads(header, buffers=buffers)
+
+
+def recv_all(remotes, remote_index, recv=Connection.recv):
+    """
+    Receive one message from each remote, draining the pipes in completion order so results of
+    fast envs are deserialized while slow ones are still stepping. Results are returned in the
+    order of remotes; remote_index maps each remote to its position.
+    """
+    results = [None] * len(remotes)
+    pending = set(remotes)
+    while pending:
+        for remote in wait(pending):
+            results[remote_index[remote]] = recv(remote)
+            pending.discard(remote)
+    return results
+
+
+def join_all(processes, timeout=None):
+    """
+    Join processes in the order they exit, waiting on their sentinels. Processes still alive
+    after timeout seconds (None waits indefinitely) are terminated.
+    """
+    pending = {p.sentinel: p for p in processes}
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while pending:
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        ready = wait(list(pending), remaining)
+        if not ready:
+            break
+        for sentinel in ready:
+            pending.pop(sentinel).join()
+    for p in pending.values():
+        p.terminate()
+        p.join()
+
+
 class ShareVecEnv(ABC):
     """
     An abstract asynchronous, vectorized environment.
@@ -153,160 +252,374 @@ class ShareVecEnv(ABC):
 def shareworker(remote, parent_remote, env_fn_wrapper):
     parent_remote.close()
     env = env_fn_wrapper.x()
-    while True:
-        cmd, data = remote.recv()
-        if cmd == 'step':
-            ob, s_ob, reward, done, info, available_actions = env.step(data)
-            if 'bool' in done.__class__.__name__:
-                if done:
-                    ob, s_ob, available_actions = env.reset()
+    env_step, env_reset = env.step, env.reset
+    # views of this env's rows in the shared obs/share_obs/rews/dones/available_actions blocks,
+    # set once the parent sends CMD_ATTACH_SHM; until then results go through the pipe. Each block
+    # has two slots, written alternately by successive step/reset calls
+    shms, bufs, slot = [], None, 0
+    # reduces the env's done to "episode over", picked on the first step: a single flag is taken
+    # as is, per-agent flags in an ndarray go through the method form .all()
+    all_done = None
+    # actions of this env; the first step's arrive pickled and fix shape and dtype, later ones are
+    # received as raw bytes straight into this buffer through its flat byte view act_bytes
+    act_buf = act_bytes = None
+
+    def step():
+        nonlocal slot, all_done, act_buf, act_bytes
+        if act_buf is None:
+            act_buf = np.array(remote.recv())
+            # recv_bytes_into sizes its target by the first axis only, so receive into a 1-D
+            # byte view; it also covers 0-d actions, which have no first axis at all
+            act_bytes = act_buf.reshape(-1).view(np.uint8)
+        else:
+            remote.recv_bytes_into(act_bytes)
+        ob, s_ob, reward, done, info, available_actions = env_step(act_buf)
+        if all_done is None:
+            if isinstance(done, (bool, np.bool_)):
+                all_done = bool
+            elif isinstance(done, np.ndarray):
+                all_done = np.ndarray.all
             else:
-                if np.all(done):
-                    ob, s_ob, available_actions = env.reset()
-
-            remote.send((ob, s_ob, reward, done, info, available_actions))
-        elif cmd == 'reset':
-            ob, s_ob, available_actions = env.reset()
-            remote.send((ob, s_ob, available_actions))
-        elif cmd == 'reset_task':
-            ob = env.reset_task()
-            remote.send(ob)
-        elif cmd == 'render':
-            if data == "rgb_array":
-                fr = env.render(mode=data)
-                remote.send(fr)
-            elif data == "human":
-                env.render(mode=data)
-        elif cmd == 'close':
-            env.close()
-            remote.close()
-            break
-        elif cmd == 'get_spaces':
-            remote.send(
-                (env.observation_space, env.share_observation_space, env.action_space))
-        elif cmd == 'render_vulnerability':
-            fr = env.render_vulnerability(data)
-            remote.send((fr))
+                all_done = np.all
+        if all_done(done):
+            ob, s_ob, available_actions = env_reset()
+
+        if bufs is None:
+            send_oob(remote, (ob, s_ob, reward, done, info, available_actions))
         else:
+            bufs[0][slot] = ob
+            bufs[1][slot] = s_ob
+            bufs[2][slot] = reward
+            bufs[3][slot] = done
+            bufs[4][slot] = available_actions
+            slot ^= 1
+            remote.send(info)
+
+    def reset():
+        nonlocal slot
+        ob, s_ob, available_actions = env_reset()
+        if bufs is None:
+            send_oob(remote, (ob, s_ob, available_actions))
+        else:
+            bufs[0][slot] = ob
+            bufs[1][slot] = s_ob
+            bufs[4][slot] = available_actions
+            slot ^= 1
+            remote.send(None)
+
+    def reset_task():
+        ob = env.reset_task()
+        remote.send(ob)
+
+    def render():
+        data = remote.recv()
+        if data == "rgb_array":
+            fr = env.render(mode=data)
+            remote.send(fr)
+        elif data == "human":
+            env.render(mode=data)
+
+    def close():
+        nonlocal bufs
+        env.close()
+        # the views must go before the mappings can be closed
+        bufs = None
+        for shm in shms:
+            shm.close()
+        remote.close()
+        return True
+
+    def get_spaces():
+        remote.send(
+            (env.observation_space, env.share_observation_space, env.action_space))
+
+    def render_vulnerability():
+        fr = env.render_vulnerability(remote.recv())
+        remote.send((fr))
+
+    def attach_shm():
+        nonlocal shms, bufs, slot
+        index, specs = remote.recv()
+        shms = [SharedMemory(name=name) for name, _, _ in specs]
+        bufs = [np.ndarray(shape, dtype=dtype, buffer=shm.buf)[:, index]
+                for shm, (_, shape, dtype) in zip(shms, specs)]
+        slot = 0
+
+    # handlers return True when the worker should exit
+    handlers = {
+        CMD_STEP: step,
+        CMD_RESET: reset,
+        CMD_RESET_TASK: reset_task,
+        CMD_RENDER: render,
+        CMD_CLOSE: close,
+        CMD_GET_SPACES: get_spaces,
+        CMD_RENDER_VULNERABILITY: render_vulnerability,
+        CMD_ATTACH_SHM: attach_shm,
+    }
+    recv_bytes = remote.recv_bytes
+    while True:
+        handler = handlers.get(recv_bytes()[0])
+        if handler is None:
             raise NotImplementedError
+        if handler():
+            break
 
 
 class ShareSubprocVecEnv(ShareVecEnv):
-    def __init__(self, env_fns, spaces=None):
+    def __init__(self, env_fns, spaces=None, copy_outputs=True, start_method=None):
         """
         envs: list of gym environments to run in subprocesses
+        copy_outputs: if False, step_wait/reset return views into the shared slots instead of
+            copies. A slot is written again two step/reset calls later, so callers must not hold
+            on to the arrays longer than that. After close() the views no longer receive data;
+            their memory stays mapped, so reading them is safe but their contents are stale
+        start_method: multiprocessing start method of the workers ('fork', 'spawn' or
+            'forkserver'), fork where available by default
         """
         self.waiting = False
+        self.copy_outputs = copy_outputs
         self.closed = False
+        self._shms, self._shm_bufs, self._slot = [], None, 0
+        self._avail_out = None
+        self._actions = None
+        # set once views into the shared blocks were returned to the caller
+        self._views_out = not copy_outputs
+        # workers attach to the shared blocks later; they must report to our tracker rather than
+        # start their own, which would unlink the blocks when the worker exits
+        resource_tracker.ensure_running()
         nenvs = len(env_fns)
-        self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(nenvs)])
-        self.ps = [Process(target=shareworker, args=(work_remote, remote, CloudpickleWrapper(env_fn)))
+        ctx = _get_context(start_method)
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(nenvs)])
+        self.ps = [ctx.Process(target=shareworker, args=(work_remote, remote, CloudpickleWrapper(env_fn)))
                    for (work_remote, remote, env_fn) in zip(self.work_remotes, self.remotes, env_fns)]
         for p in self.ps:
             p.daemon = True  # if the main process crashes, we should not cause things to hang
             p.start()
         for remote in self.work_remotes:
             remote.close()
-        self.remotes[0].send(('get_spaces', None))
+        self._remote_index = {remote: i for i, remote in enumerate(self.remotes)}
+        self.remotes[0].send_bytes(_CMD_BYTES[CMD_GET_SPACES])
         observation_space, share_observation_space, action_space = self.remotes[0].recv(
         )
         ShareVecEnv.__init__(self, len(env_fns), observation_space,
                              share_observation_space, action_space)
 
+    def _attach_shm(self, obs, share_obs, rews, dones, available_actions):
+        """
+        Allocate one shared memory block per step output, shaped (2, num_envs, ...) after the first
+        step's results, and hand them to the workers. From then on workers write their results in
+        place, alternating between the two slots, and only send infos back through the pipe.
+        """
+        specs = []
+        for arr in (obs, share_obs, rews, dones, available_actions):
+            dtype = arr.dtype
+            if arr is available_actions and dtype != np.uint8 and np.array_equal(arr, arr.astype(bool)):
+                # a 0/1 mask travels as uint8 and is widened back into _avail_out on our side
+                self._avail_out = np.empty((2,) + arr.shape, dtype=dtype)
+                dtype = np.dtype(np.uint8)
+            shm = SharedMemory(create=True, size=max(2 * arr.size * dtype.itemsize, 1))
+            self._shms.append(shm)
+            specs.append((shm.name, (2,) + arr.shape, dtype.str))
+        self._shm_bufs = [np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+                          for shm, (_, shape, dtype) in zip(self._shms, specs)]
+        for index, remote in enumerate(self.remotes):
+            remote.send_bytes(_CMD_BYTES[CMD_ATTACH_SHM])
+            remote.send((index, specs))
+
     def step_async(self, actions):
-        for remote, action in zip(self.remotes, actions):
-            remote.send(('step', action))
+        step = _CMD_BYTES[CMD_STEP]
+        if self._actions is None:
+            # the first actions go pickled so the workers learn their shape and dtype,
+            # from then on each env's row is sent as raw bytes
+            self._actions = np.array(actions)
+            for remote, action in zip(self.remotes, self._actions):
+                remote.send_bytes(step)
+                remote.send(action)
+        else:
+            self._actions[...] = actions
+            for remote, action in zip(self.remotes, self._actions):
+                remote.send_bytes(step)
+                remote.send_bytes(memoryview(action).cast('B'))
         self.waiting = True
 
-    def step_wait(self):
-        results = [remote.recv() for remote in self.remotes]
+    def _recv_step(self):
+        """
+        Collect the step in flight. Returns views into the shared slot the workers just filled,
+        or freshly stacked arrays while the shared blocks do not exist yet.
+        """
+        recv = recv_oob if self._shm_bufs is None else Connection.recv
+        results = recv_all(self.remotes, self._remote_index, recv)
         self.waiting = False
-        obs, share_obs, rews, dones, infos, available_actions = zip(*results)
-        return np.stack(obs), np.stack(share_obs), np.stack(rews), np.stack(dones), infos, np.stack(available_actions)
+        if self._shm_bufs is None:
+            obs, share_obs, rews, dones, infos, available_actions = zip(*results)
+            obs, share_obs, rews, dones, available_actions = (
+                np.stack(obs), np.stack(share_obs), np.stack(rews), np.stack(dones), np.stack(available_actions))
+            # rewards of an already finished env come back as ints, keep room for real ones; the
+            # shared block takes this dtype too, so every step returns the same one
+            rews = rews.astype(np.promote_types(rews.dtype, np.float64), copy=False)
+            self._attach_shm(obs, share_obs, rews, dones, available_actions)
+            return obs, share_obs, rews, dones, infos, available_actions
+        obs, share_obs, rews, dones = (buf[self._slot] for buf in self._shm_bufs[:4])
+        available_actions = self._available_actions()
+        self._slot ^= 1
+        return obs, share_obs, rews, dones, tuple(results), available_actions
+
+    def _available_actions(self):
+        """Available actions of the current slot, in the dtype the envs reported them in."""
+        available_actions = self._shm_bufs[4][self._slot]
+        if self._avail_out is None:
+            return available_actions
+        out = self._avail_out[self._slot]
+        np.copyto(out, available_actions)
+        return out
+
+    def step_wait(self):
+        shared = self._shm_bufs is not None
+        obs, share_obs, rews, dones, infos, available_actions = self._recv_step()
+        if shared and self.copy_outputs:
+            # the slot is written again two steps later, callers get their own copy
+            obs, share_obs, rews, dones, available_actions = (
+                obs.copy(), share_obs.copy(), rews.copy(), dones.copy(), available_actions.copy())
+        return obs, share_obs, rews, dones, infos, available_actions
+
+    def step_async_next(self, actions):
+        """
+        Collect the step in flight and immediately dispatch the next one with the given actions,
+        so the workers step batch t+1 while the caller works on batch t. The returned arrays are
+        views into the shared slot just filled (the workers write the other one meanwhile); they
+        stay valid until the following step_async_next/step_wait, copy whatever must outlive that.
+        After close() the arrays no longer receive data; their memory stays mapped, so reading
+        them is safe but their contents are stale.
+        A step must already be in flight: start the pipeline with step_async.
+        """
+        if not self.waiting:
+            raise RuntimeError("step_async_next needs a step in flight, call step_async first")
+        self._views_out = True
+        results = self._recv_step()
+        self.step_async(actions)
+        return results
+
+    def _drain_step(self):
+        """
+        Collect and discard a step still in flight (always the case after step_async_next), so
+        the next reply read from the pipes is the one asked for and the shared slot stays in step
+        with the workers.
+        """
+        if self.waiting:
+            self._recv_step()
 
     def reset(self):
+        self._drain_step()
         for remote in self.remotes:
-            remote.send(('reset', None))
-        results = [remote.recv() for remote in self.remotes]
-        obs, share_obs, available_actions = zip(*results)
-        return np.stack(obs), np.stack(share_obs), np.stack(available_actions)
+            remote.send_bytes(_CMD_BYTES[CMD_RESET])
+        recv = recv_oob if self._shm_bufs is None else Connection.recv
+        results = recv_all(self.remotes, self._remote_index, recv)
+        if self._shm_bufs is None:
+            obs, share_obs, available_actions = zip(*results)
+            return np.stack(obs), np.stack(share_obs), np.stack(available_actions)
+        obs, share_obs = self._shm_bufs[0][self._slot], self._shm_bufs[1][self._slot]
+        available_actions = self._available_actions()
+        self._slot ^= 1
+        if self.copy_outputs:
+            return obs.copy(), share_obs.copy(), available_actions.copy()
+        return obs, share_obs, available_actions
 
     def reset_task(self):
+        self._drain_step()
         for remote in self.remotes:
-            remote.send(('reset_task', None))
+            remote.send_bytes(_CMD_BYTES[CMD_RESET_TASK])
         return np.stack([remote.recv() for remote in self.remotes])
 
-    def close(self):
+    def close(self, timeout=None):
+        """
+        timeout: seconds to wait for the workers to shut their envs down before terminating
+            them, no limit by default
+        """
         if self.closed:
             return
         if self.waiting:
-            for remote in self.remotes:
-                remote.recv()
+            recv = recv_oob if self._shm_bufs is None else Connection.recv
+            recv_all(self.remotes, self._remote_index, recv)
         for remote in self.remotes:
-            remote.send(('close', None))
-        for p in self.ps:
-            p.join()
+            remote.send_bytes(_CMD_BYTES[CMD_CLOSE])
+        join_all(self.ps, timeout)
+        self._shm_bufs = None
+        for shm in self._shms:
+            shm.unlink()
+            if self._views_out:
+                _MAPPED_SHMS.append(shm)
+            else:
+                shm.close()
         self.closed = True
 
 
-import numpy as np
-from multiprocessing import Process, Pipe
-import torch
-
 class HybridVecEnv:
     """混合向量化环境：少量进程，每个进程多环境"""
-    def __init__(self, env_fns, n_procs=12):
+    def __init__(self, env_fns, n_procs=12, start_method=None):
         """
         Args:
             env_fns: 环境创建函数列表
             n_procs: 实际使用的进程数
+            start_method: 子进程启动方式（'fork'/'spawn'/'forkserver'），默认在支持时使用 fork
         """
         self.waiting = False
         self.closed = False
         self.total_envs = len(env_fns)
         self.n_procs = min(n_procs, self.total_envs)
         self.envs_per_proc = self.total_envs // self.n_procs
+        # 每个进程负责的环境区间固定，切片只需计算一次
+        self._slices = [slice(i * self.envs_per_proc, (i + 1) * self.envs_per_proc) for i in range(self.n_procs)]
+        # obs / share_obs / available_actions 的输出缓冲区，第一次收到结果时按其形状分配
+        self._outs = None
         
         # 创建管道
-        self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(self.n_procs)])
+        ctx = _get_context(start_method)
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(self.n_procs)])
         self.ps = []
-        for proc_idx in range(self.n_procs):
-            start_idx = proc_idx * self.envs_per_proc
-            end_idx = start_idx + self.envs_per_proc
-            env_group = env_fns[start_idx:end_idx]
-            process = Process(
+        for proc_idx, env_slice in enumerate(self._slices):
+            env_group = env_fns[env_slice]
+            process = ctx.Process(
                 target=self.worker,
-                args=(self.work_remotes[proc_idx], self.remotes[proc_idx], env_group)
+                args=(self.work_remotes[proc_idx], self.remotes[proc_idx], CloudpickleWrapper(env_group))
             )
             process.daemon = True
             process.start()
             self.ps.append(process)
         for remote in self.work_remotes:
             remote.close()
+        self._remote_index = {remote: i for i, remote in enumerate(self.remotes)}
     
     @staticmethod
-    def worker(remote, parent_remote, env_fns):
+    def worker(remote, parent_remote, env_fns_wrapper):
         parent_remote.close()
-        envs = [fn() for fn in env_fns]
+        # 环境创建和 reset（首次 reset 会启动 SC2 进程）大多在等待 I/O，会释放 GIL，
+        # 因此用线程池让本进程内的多个环境并发完成，而不是逐个等待
+        pool = ThreadPoolExecutor(max_workers=len(env_fns_wrapper.x))
+        envs = list(pool.map(lambda fn: fn(), env_fns_wrapper.x))
+        # 本进程内各环境结果预先堆叠成连续数组，缓冲区在第一次返回时分配，之后复用
+        stacked = None
         try:
             while True:
                 cmd, data = remote.recv()
                 if cmd == 'step':
                     # 对应一个 step 调用，假设每个 env.step(a) 返回 (obs, share_obs, reward, done, info, available_actions)
-                    results = [env.step(a) for env, a in zip(envs, data)]
-                    # 整理返回值：分组（此处务必保证返回数据结构和外部接口匹配）
                     # 假设外部只需要 obs、share_obs 和 available_actions（其它信息在本实验中不需要）
-                    obs, share_obs, _, _, _, available_actions = zip(*results)
-                    # 返回每个子进程管理的各个环境的数据
-                    remote.send((obs, share_obs, available_actions))
+                    results = []
+                    for env, a in zip(envs, data):
+                        ob, s_ob, _, _, _, available_actions = env.step(a)
+                        results.append((ob, s_ob, available_actions))
+                    stacked = HybridVecEnv._stack(results, stacked)
+                    # 每个子进程只发送一次堆叠好的数组
+                    send_oob(remote, stacked)
                 elif cmd == 'reset':
                     # 每个环境的 reset 返回 (obs, share_obs, available_actions)
-                    results = [env.reset() for env in envs]
-                    obs, share_obs, available_actions = zip(*results)
-                    remote.send((obs, share_obs, available_actions))
+                    results = list(pool.map(lambda env: env.reset(), envs))
+                    stacked = HybridVecEnv._stack(results, stacked)
+                    send_oob(remote, stacked)
                 elif cmd == 'close':
                     for env in envs:
                         env.close()
+                    pool.shutdown()
                     remote.close()
                     break
                 else:
@@ -315,46 +628,65 @@ class HybridVecEnv:
             print(f"Worker异常: {e}")
             raise
 
+    @staticmethod
+    def _stack(results, out=None):
+        """
+        把各环境的 (obs, share_obs, available_actions) 按环境下标直接写入 out 中对应的行，
+        不再先转置成三个元组；out 为空时（第一次调用）按结果的形状和类型分配。
+        """
+        if out is None:
+            return tuple(np.stack([r[k] for r in results]) for k in range(3))
+        obs, share_obs, available_actions = out
+        for i, (ob, s_ob, avail) in enumerate(results):
+            obs[i] = ob
+            share_obs[i] = s_ob
+            available_actions[i] = avail
+        return out
+
     def reset(self):
         for remote in self.remotes:
             remote.send(('reset', None))
-        results = [remote.recv() for remote in self.remotes]
-        obs_all, share_obs_all, avail_actions_all = [], [], []
-        for obs, share_obs, avail_actions in results:
-            obs_all.extend(obs)
-            share_obs_all.extend(share_obs)
-            avail_actions_all.extend(avail_actions)
+        results = recv_all(self.remotes, self._remote_index, recv_oob)
         # 返回三个元素
-        return obs_all, share_obs_all, avail_actions_all
+        return self._gather(results)
+
+    def _gather(self, results):
+        """
+        把各进程堆叠好的结果拼接进预分配的输出缓冲区并直接返回。
+        缓冲区会被下一次 step/reset 覆盖，需要跨步保留的数据请自行 copy。
+        """
+        if self._outs is None:
+            n_envs = self.n_procs * self.envs_per_proc
+            self._outs = tuple(np.empty((n_envs,) + arr.shape[1:], dtype=arr.dtype) for arr in results[0])
+        for i, out in enumerate(self._outs):
+            np.concatenate([r[i] for r in results], out=out)
+        return self._outs
 
     def step(self, actions):
         self.step_async(actions)
         return self.step_wait()
     
     def step_async(self, actions):
-        action_chunks = np.array_split(actions, self.n_procs)
-        for remote, action_chunk in zip(self.remotes, action_chunks):
-            remote.send(('step', action_chunk))
+        actions = np.ascontiguousarray(actions)
+        for remote, env_slice in zip(self.remotes, self._slices):
+            remote.send(('step', actions[env_slice]))
         self.waiting = True
         
     def step_wait(self):
-        results = [remote.recv() for remote in self.remotes]
+        results = recv_all(self.remotes, self._remote_index, recv_oob)
         self.waiting = False
-        obs_all, share_obs_all, avail_actions_all = [], [], []
-        for obs, share_obs, avail_actions in results:
-            obs_all.extend(obs)
-            share_obs_all.extend(share_obs)
-            avail_actions_all.extend(avail_actions)
-        return obs_all, share_obs_all, avail_actions_all
+        return self._gather(results)
 
-    def close(self):
+    def close(self, timeout=None):
+        """
+        Args:
+            timeout: 等待子进程关闭环境的秒数，超时仍未退出的进程会被终止；默认不限时
+        """
         if self.closed:
             return
         if self.waiting:
-            for remote in self.remotes:
-                remote.recv()
+            recv_all(self.remotes, self._remote_index, recv_oob)
         for remote in self.remotes:
             remote.send(('close', None))
-        for p in self.ps:
-            p.join()
+        join_all(self.ps, timeout)
         self.closed = True
\ No newline at end of file